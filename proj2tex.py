@@ -22,18 +22,25 @@ Changelog:
 '''
 
 import maya.cmds as cmds
-import maya.utils
-import maya.mel
-import maya.OpenMayaUI as OpenMayaUI
-import maya.OpenMaya as OpenMaya
+import maya.api.OpenMayaUI as OpenMayaUI
+import maya.api.OpenMaya as OpenMaya
 import os.path
 import math
 import subprocess
 import shutil
 import glob
+import tempfile
+import hashlib
 from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as ET
-import xml.dom.minidom as minidom
+
+# Pillow is optional, ImageMagick is used without it
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 VERSION = '1.7'
 
@@ -45,34 +52,103 @@ DIRECTION_BOTTOM = 'bottom'
 
 VALID_DIRECTIONS = [DIRECTION_FRONT, DIRECTION_BACK, DIRECTION_SIDE, DIRECTION_TOP, DIRECTION_BOTTOM]
 
+# per direction: center offset, rotation, flipped rotation, scale axes
+DirectionTransform = namedtuple('DirectionTransform', ['offset', 'rotation', 'flip_rotation', 'scale_axes'])
+_DIRECTION_TRANSFORMS = {
+    DIRECTION_FRONT: DirectionTransform((0, 0, 1), (0.0, 0.0, 0.0), (0.0, 180.0, 0.0), (0, 1)),
+    DIRECTION_BACK: DirectionTransform((0, 0, -1), (0.0, 180.0, 0.0), (0.0, 0.0, 0.0), (0, 1)),
+    DIRECTION_SIDE: DirectionTransform((1, 0, 0), (0.0, 90.0, 0.0), (0.0, -90.0, 0.0), (2, 1)),
+    DIRECTION_TOP: DirectionTransform((0, 1, 0), (-90.0, 0.0, 0.0), (90.0, 0.0, 0.0), (0, 2)),
+    DIRECTION_BOTTOM: DirectionTransform((0, -1, 0), (90.0, 0.0, 0.0), (-90.0, 0.0, 0.0), (0, 2))
+}
+
+# per (direction, flip): bbox interpolation weights of the crop corners
+_DIRECTION_CROP_CORNERS = {
+    (DIRECTION_FRONT, False): ((0, 0, 0.5), (1, 1, 0.5)),
+    (DIRECTION_FRONT, True): ((1, 0, 0.5), (0, 1, 0.5)),
+    (DIRECTION_BACK, False): ((1, 0, 0.5), (0, 1, 0.5)),
+    (DIRECTION_BACK, True): ((0, 0, 0.5), (1, 1, 0.5)),
+    (DIRECTION_SIDE, False): ((0.5, 0, 1), (0.5, 1, 0)),
+    (DIRECTION_SIDE, True): ((0.5, 0, 0), (0.5, 1, 1)),
+    (DIRECTION_TOP, False): ((0, 0.5, 1), (1, 0.5, 0)),
+    (DIRECTION_TOP, True): ((0, 0.5, 0), (1, 0.5, 1)),
+    (DIRECTION_BOTTOM, False): ((0, 0.5, 0), (1, 0.5, 1)),
+    (DIRECTION_BOTTOM, True): ((0, 0.5, 1), (1, 0.5, 0))
+}
+
+_SCREENSHOT_TMP_FORMAT = 'bmp'
+
+_fast_maya_depth = 0
+
+_magick_convert_cache = None
+
+# single undo chunk with refresh and evaluation suspended; nested uses are no-ops
+@contextmanager
+def _fast_maya_context(suspend_refresh=True):
+    global _fast_maya_depth
+    if _fast_maya_depth > 0:
+        _fast_maya_depth += 1
+        try:
+            yield
+        finally:
+            _fast_maya_depth -= 1
+        return
+    prev_eval_mode = cmds.evaluationManager(q=True, mode=True)[0]
+    prev_suppress_info = cmds.scriptEditorInfo(q=True, suppressInfo=True)
+    cmds.undoInfo(openChunk=True)
+    _fast_maya_depth += 1
+    try:
+        if suspend_refresh:
+            cmds.refresh(suspend=True)
+        cmds.evaluationManager(mode='off')
+        cmds.scriptEditorInfo(suppressInfo=True)
+        yield
+    finally:
+        try:
+            cmds.scriptEditorInfo(suppressInfo=prev_suppress_info)
+            cmds.evaluationManager(mode=prev_eval_mode)
+            if suspend_refresh:
+                cmds.refresh(suspend=False)
+        finally:
+            cmds.undoInfo(closeChunk=True)
+            _fast_maya_depth -= 1
+
 class Projection:
     def __init__(self, name, direction, flip, image_path):
+        if direction not in VALID_DIRECTIONS:
+            raise Exception(
+                'unrecognized projection direction \'{}\', valid options are {}'.format(direction, VALID_DIRECTIONS))
         self.name = name
         self.direction = direction
         self.flip = flip
         self.image_path = image_path
+        self._image_stem, ext = os.path.splitext(image_path)
+        self.image_format = ext[1:]
+        self._place3dTexture = 'place3dTex_{}'.format(name)
+        self._projection = 'proj_{}'.format(name)
+        self._file = 'projFile_{}'.format(name)
 
     def place3dTexture(self):
-        return 'place3dTex_{}'.format(self.name)
+        return self._place3dTexture
 
     def projection(self):
-        return 'proj_{}'.format(self.name)
+        return self._projection
 
     def file(self):
-        return 'projFile_{}'.format(self.name)
+        return self._file
 
     def baked_image_path(self, geom):
-        file_format = os.path.splitext(self.image_path)[1][1:]
-        return os.path.splitext(self.image_path)[0] + '_baked_{}.{}'.format(geom, file_format)
+        return '{}_baked_{}.{}'.format(self._image_stem, geom, self.image_format)
 
 class Layer:
     def __init__(self, name, color_proj_name, transparency_proj_name):
         self.name = name
         self.color_proj_name = color_proj_name
         self.transparency_proj_name = transparency_proj_name
+        self._layer_material = 'layerMat_{}'.format(name)
 
     def layer_material(self):
-        return 'layerMat_{}'.format(self.name)
+        return self._layer_material
 
 class Proj2Tex:
     def __init__(self, targets, projections, layers,
@@ -80,43 +156,67 @@ class Proj2Tex:
                  fill_texture_seams=True):
         self.targets = targets
         self.projections = projections
+        self._projections_by_name = {proj.name: proj for proj in projections}
         self.layers = layers
+        used_proj_names = {name for l in layers for name in (l.color_proj_name, l.transparency_proj_name)}
+        self._layer_projections = [proj for proj in projections if proj.name in used_proj_names]
         self.combined_image_path = combined_image_path
+        self._combined_image_stem, ext = os.path.splitext(combined_image_path)
+        self._combined_image_format = ext[1:]
         self.projection_padding = projection_padding
         self.screenshot_res = screenshot_res
         self.baked_texture_res = baked_texture_res
         self.fill_texture_seams = fill_texture_seams
+        self._bbox_cache = None
+        self._target_geometry_cache = None
+        self._layered_shader_cache = None
 
     def _find_projection_by_name(self, name):
+        if name not in self._projections_by_name:
+            raise Exception('no projection exists with name \'{}\''.format(name))
+        return self._projections_by_name[name]
+
+    @staticmethod
+    def _delete_existing(nodes):
+        # ls with no names lists the whole scene
+        if not nodes:
+            return
+        existing = cmds.ls(nodes)
+        if existing:
+            cmds.delete(existing)
+
+    def _projection_nodes(self):
+        nodes = []
         for proj in self.projections:
-            if proj.name == name:
-                return proj
-        raise Exception('no projection exists with name \'{}\''.format(name))
+            nodes += [proj.place3dTexture(), proj.projection(), proj.file()]
+        return nodes
+
+    def _layered_shader_nodes(self):
+        nodes = [l.layer_material() for l in self.layers]
+        nodes.append(self._layered_shader())
+        return nodes
+
+    def _shader_nodes(self):
+        nodes = []
+        for geom in self._get_all_target_geometry():
+            nodes += [self._shader(geom), self._shader_file(geom)]
+        return nodes
 
     def _clear_projections(self):
-        for proj in self.projections:
-            if cmds.objExists(proj.place3dTexture()):
-                cmds.delete(proj.place3dTexture())
-            if cmds.objExists(proj.projection()):
-                cmds.delete(proj.projection())
-            if cmds.objExists(proj.file()):
-                cmds.delete(proj.file())
+        Proj2Tex._delete_existing(self._projection_nodes())
 
     def _clear_layered_shader(self):
-        for l in self.layers:
-            if cmds.objExists(l.layer_material()):
-                cmds.delete(l.layer_material())
-        if cmds.objExists(self._layered_shader()):
-            cmds.delete(self._layered_shader())
+        Proj2Tex._delete_existing(self._layered_shader_nodes())
+
+    def _invalidate_target_geometry(self):
+        self._target_geometry_cache = None
+        self._bbox_cache = None
+        self._layered_shader_cache = None
 
+    @_fast_maya_context()
     def clear_nodes(self):
-        self._clear_projections()
-        self._clear_layered_shader()
-        for geom in self._get_all_target_geometry():
-            if cmds.objExists(self._shader(geom)):
-                cmds.delete(self._shader(geom))
-            if cmds.objExists(self._shader_file(geom)):
-                cmds.delete(self._shader_file(geom))
+        self._invalidate_target_geometry()
+        Proj2Tex._delete_existing(self._projection_nodes() + self._layered_shader_nodes() + self._shader_nodes())
 
     def _configure_lambert_material(self, mat):
         cmds.setAttr(mat + '.diffuse', 1.0)
@@ -124,6 +224,16 @@ class Proj2Tex:
         cmds.setAttr(mat + '.translucenceDepth', 0.0)
         cmds.setAttr(mat + '.translucenceFocus', 0.0)
 
+    @staticmethod
+    def _assign_shader(shader, objects):
+        sgs = cmds.listConnections(shader + '.outColor', d=True, s=False, type='shadingEngine')
+        if sgs:
+            sg = sgs[0]
+        else:
+            sg = cmds.sets(name=shader + 'SG', renderable=True, noSurfaceShader=True, empty=True)
+            cmds.connectAttr(shader + '.outColor', sg + '.surfaceShader', f=True)
+        cmds.sets(objects, edit=True, forceElement=sg)
+
     @staticmethod
     def is_target_shader(target):
         return cmds.getClassification(cmds.objectType(target), satisfies='shader')
@@ -142,96 +252,53 @@ class Proj2Tex:
         else:
             return target
 
+    def _get_target_geometry_map(self):
+        if self._target_geometry_cache is None:
+            self._target_geometry_cache = {target: Proj2Tex.get_target_geometry(target) for target in self.targets}
+        return self._target_geometry_cache
+
     def _get_all_target_geometry(self):
-        geom = set()
-        for target in self.targets:
-            geom.add(Proj2Tex.get_target_geometry(target))
-        return list(geom)
+        return list(set(self._get_target_geometry_map().values()))
 
     def compute_bbox(self):
+        if self._bbox_cache is not None:
+            return self._bbox_cache
         xmin, ymin, zmin, xmax, ymax, zmax = cmds.exactWorldBoundingBox(self._get_all_target_geometry(), calculateExactly=True)
         padding = self.projection_padding*math.sqrt((xmax - xmin)**2 + (ymax - ymin)**2 + (zmax - zmin)**2)
         xc, yc, zc = (xmin + xmax)/2.0, (ymin + ymax)/2.0, (zmin + zmax)/2.0
         extX, extY, extZ = (xmax - xmin)/2.0, (ymax - ymin)/2.0, (zmax - zmin)/2.0
-        return xc - extX - padding, yc - extY - padding, zc - extZ - padding, \
-               xc + extX + padding, yc + extY + padding, zc + extZ + padding
+        self._bbox_cache = (xc - extX - padding, yc - extY - padding, zc - extZ - padding,
+                            xc + extX + padding, yc + extY + padding, zc + extZ + padding)
+        return self._bbox_cache
 
     @staticmethod
     def convert_to_cm(val):
         return float(cmds.convertUnit(val, fromUnit=cmds.currentUnit(q=True, linear=True), toUnit='cm').replace('cm', ''))    
 
+    @_fast_maya_context()
     def make_projections(self):
         self.clear_nodes()
         xmin, ymin, zmin, xmax, ymax, zmax = self.compute_bbox()
+        center = ((xmin + xmax)/2, (ymin + ymax)/2, (zmin + zmax)/2)
+        extents = ((xmax - xmin)/2, (ymax - ymin)/2, (zmax - zmin)/2)
+        cm_per_unit = Proj2Tex.convert_to_cm(1.0)
         for proj in self.projections:
-            cmds.shadingNode('place3dTexture', name=proj.place3dTexture(), asUtility=True)
-            posX, posY, posZ = (xmin + xmax)/2, (ymin + ymax)/2, (zmin + zmax)/2
-            extX, extY, extZ = (xmax - xmin)/2, (ymax - ymin)/2, (zmax - zmin)/2
-
+            cmds.shadingNode('place3dTexture', name=proj.place3dTexture(), asUtility=True, skipSelect=True)
+            transform = _DIRECTION_TRANSFORMS[proj.direction]
+            pos = tuple(c + o*e for c, o, e in zip(center, transform.offset, extents))
+            rot = transform.flip_rotation if proj.flip else transform.rotation
             # projection will always be created as 2cm x 2cm regardless of current measurement size, so first convert scale to cm
-            if proj.direction == DIRECTION_FRONT:
-                posZ += extZ
-                if proj.flip:
-                    rotX, rotY, rotZ = 0.0, 180.0, 0.0    
-                else:
-                    rotX, rotY, rotZ = 0.0, 0.0, 0.0
-                sclX, sclY, sclZ = Proj2Tex.convert_to_cm(extX), Proj2Tex.convert_to_cm(extY), 1.0
-            elif proj.direction == DIRECTION_BACK:
-                posZ -= extZ
-                if proj.flip:
-                    rotX, rotY, rotZ = 0.0, 0.0, 0.0
-                else:
-                    rotX, rotY, rotZ = 0.0, 180.0, 0.0
-                sclX, sclY, sclZ = Proj2Tex.convert_to_cm(extX), Proj2Tex.convert_to_cm(extY), 1.0
-            elif proj.direction == DIRECTION_SIDE:
-                posX += extX
-                if proj.flip:
-                    rotX, rotY, rotZ = 0.0, -90.0, 0.0
-                else:
-                    rotX, rotY, rotZ = 0.0, 90.0, 0.0
-                sclX, sclY, sclZ = Proj2Tex.convert_to_cm(extZ), Proj2Tex.convert_to_cm(extY), 1.0
-            elif proj.direction == DIRECTION_TOP:
-                posY += extY
-                if proj.flip:
-                    rotX, rotY, rotZ = 90.0, 0.0, 0.0
-                else:
-                    rotX, rotY, rotZ = -90.0, 0.0, 0.0
-                sclX, sclY, sclZ = Proj2Tex.convert_to_cm(extX), Proj2Tex.convert_to_cm(extZ), 1.0
-            elif proj.direction == DIRECTION_BOTTOM:
-                posY -= extY
-                if proj.flip:
-                    rotX, rotY, rotZ = -90.0, 0.0, 0.0
-                else:
-                    rotX, rotY, rotZ = 90.0, 0.0, 0.0
-                sclX, sclY, sclZ = Proj2Tex.convert_to_cm(extX), Proj2Tex.convert_to_cm(extZ), 1.0
-            else:
-                raise Exception(
-                    'unrecognized projection direction \'{}\', valid options are {}'.format(proj.direction, VALID_DIRECTIONS))
-            
-            cmds.setAttr(proj.place3dTexture() + '.translateX', posX)
-            cmds.setAttr(proj.place3dTexture() + '.translateY', posY)
-            cmds.setAttr(proj.place3dTexture() + '.translateZ', posZ)
-            cmds.setAttr(proj.place3dTexture() + '.rotateX', rotX)
-            cmds.setAttr(proj.place3dTexture() + '.rotateY', rotY)
-            cmds.setAttr(proj.place3dTexture() + '.rotateZ', rotZ)
-            cmds.setAttr(proj.place3dTexture() + '.scaleX', sclX) 
-            cmds.setAttr(proj.place3dTexture() + '.scaleY', sclY)
-            cmds.setAttr(proj.place3dTexture() + '.scaleZ', sclZ)
-
-            cmds.shadingNode('projection', name=proj.projection(), asUtility=True)
+            scl = (extents[transform.scale_axes[0]]*cm_per_unit, extents[transform.scale_axes[1]]*cm_per_unit, 1.0)
+            cmds.xform(proj.place3dTexture(), translation=pos, rotation=rot, scale=scl, objectSpace=True)
+
+            cmds.shadingNode('projection', name=proj.projection(), asUtility=True, skipSelect=True)
             cmds.connectAttr(proj.place3dTexture() + '.worldInverseMatrix', proj.projection() + '.placementMatrix', f=True)
 
     @staticmethod
-    def _world_to_viewport_pt(view, pt):
-        p = OpenMaya.MPoint(Proj2Tex.convert_to_cm(pt[0]), Proj2Tex.convert_to_cm(pt[1]), Proj2Tex.convert_to_cm(pt[2]))
-        util_x = OpenMaya.MScriptUtil()
-        ptr_x = util_x.asShortPtr()
-        util_y = OpenMaya.MScriptUtil()
-        ptr_y = util_y.asShortPtr()
-        unclipped = view.worldToView(p, ptr_x, ptr_y)
+    def _world_to_viewport_pt(view, pt_cm):
+        p = OpenMaya.MPoint(*pt_cm)
+        x, y, unclipped = view.worldToView(p)
         if unclipped:
-            x = util_x.getShort(ptr_x)
-            y = util_y.getShort(ptr_y)
             return x, y, True
         else:
             return None, None, False
@@ -242,58 +309,81 @@ class Proj2Tex:
         max_width = 0
         max_height = 0
         for i in range(n):
-            view = OpenMayaUI.M3dView()
-            OpenMayaUI.M3dView.get3dView(i, view)
+            view = OpenMayaUI.M3dView.get3dView(i)
             max_width = max(max_width, view.portWidth())
             max_height = max(max_height, view.portHeight())
         return max_width, max_height
 
     def _find_magick_convert(self):
-        try:
-            subprocess.run(['magick'])
-            return ['magick', 'convert'], dict()
-        except FileNotFoundError:
-            try:
-                subprocess.run(['convert'])
-                return ['convert'], dict()
-            except FileNotFoundError:
-                try:
-                    subprocess.run(['/opt/local/bin/convert']) # macports install
-                    return ['/opt/local/bin/convert'], dict()
-                except FileNotFoundError:
-                    try:
-                        subprocess.run(['/usr/local/bin/convert']) # homebrew install
-                        return ['/usr/local/bin/convert'], dict()
-                    except FileNotFoundError:
-                        d = os.path.dirname(__file__)
-                        def iglob(pattern):
-                            def either(c):
-                                return '[%s%s]' % (c.lower(), c.upper()) if c.isalpha() else c
-                            return glob.glob(''.join(map(either, pattern)))
-                        magick_install = list(filter(os.path.isdir, iglob(os.path.join(d, 'imagemagick*'))))
-                        if len(magick_install) > 0:
-                            env = {
-                                'MAGICK_HOME': magick_install[0],
-                                'DYLD_LIBRARY_PATH': os.path.join(magick_install[0], 'lib')
-                            }
-                            return [os.path.join(magick_install[0], 'bin', 'magick'), 'convert'], env
-                        else:
-                            cmds.confirmDialog(title='Error: Cannot find ImageMagick',
-                                    message='A valid ImageMagick could not be found: please download the archive from the website and extract it next to the script.',
-                                    button='OK')
-                            raise Exception('ImageMagick not found')
+        global _magick_convert_cache
+        if _magick_convert_cache is not None:
+            return _magick_convert_cache
+        for candidate, conv_cmd in [
+                ('magick', ['magick', 'convert']),
+                ('convert', ['convert']),
+                ('/opt/local/bin/convert', ['/opt/local/bin/convert']), # macports install
+                ('/usr/local/bin/convert', ['/usr/local/bin/convert'])]: # homebrew install
+            if shutil.which(candidate) is not None:
+                _magick_convert_cache = (conv_cmd, dict())
+                return _magick_convert_cache
+        d = os.path.dirname(__file__)
+        def iglob(pattern):
+            def either(c):
+                return '[%s%s]' % (c.lower(), c.upper()) if c.isalpha() else c
+            return glob.glob(''.join(map(either, pattern)))
+        magick_install = list(filter(os.path.isdir, iglob(os.path.join(d, 'imagemagick*'))))
+        if len(magick_install) > 0:
+            env = {
+                'MAGICK_HOME': magick_install[0],
+                'DYLD_LIBRARY_PATH': os.path.join(magick_install[0], 'lib')
+            }
+            _magick_convert_cache = ([os.path.join(magick_install[0], 'bin', 'magick'), 'convert'], env)
+            return _magick_convert_cache
+        else:
+            cmds.confirmDialog(title='Error: Cannot find ImageMagick',
+                    message='A valid ImageMagick could not be found: please download the archive from the website and extract it next to the script.',
+                    button='OK')
+            raise Exception('ImageMagick not found')
+
+    @staticmethod
+    def _crop_image(src_path, dst_path, crop_box):
+        with Image.open(src_path) as img:
+            img.crop(crop_box).save(dst_path)
+        os.remove(src_path)
 
+    @staticmethod
+    def _crop_images_magick(crops, conv_cmd, magick_env):
+        # crop all (src_path, dst_path, crop_box) in one invocation
+        args = []
+        for src_path, dst_path, (xmin, ymin, xmax, ymax) in crops:
+            if len(args) > 0:
+                args.append('+delete')
+            args += [src_path, '-crop', '{}x{}+{}+{}'.format(xmax - xmin, ymax - ymin, xmin, ymin), '-write', dst_path]
+        args.pop(-2)
+        subprocess.run(conv_cmd + args, env={**os.environ, **magick_env}, check=True)
+
+    @_fast_maya_context(suspend_refresh=False)
     def save_screenshots(self):
         max_window_w, max_window_h = Proj2Tex._get_max_window_size()
         max_res = min(max_window_w, max_window_h)
         window_width = min(max_res, self.screenshot_res)
         window_height = window_width
         xmin, ymin, zmin, xmax, ymax, zmax = self.compute_bbox()
+        cm_per_unit = Proj2Tex.convert_to_cm(1.0)
+        def crop_corner(weights):
+            return [(lo + w*(hi - lo))*cm_per_unit for lo, hi, w in zip((xmin, ymin, zmin), (xmax, ymax, zmax), weights)]
+        crop_corners = {key: (crop_corner(w_min), crop_corner(w_max)) for key, (w_min, w_max) in _DIRECTION_CROP_CORNERS.items()}
+        # must be resolved on the main thread
+        conv_cmd, magick_env = self._find_magick_convert() if Image is None else (None, None)
         scr_cam = cmds.camera(name='proj_screenshot_cam', orthographic=True)[0]
+        crop_executor = ThreadPoolExecutor(max_workers=max(1, min(len(self.projections), os.cpu_count() or 1)))
+        pending_crops = []
+        magick_crops = []
+        tmp_dir = tempfile.mkdtemp(prefix='proj2tex_', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
         try:
-            # construct the window twice in order to address issues when changing the screenshot size
-            for i in range(2):
-                window = cmds.window('proj_screenshot_window')
+            all_geom = self._get_all_target_geometry()
+            def build_window():
+                window = cmds.window('proj_screenshot_window', widthHeight=(window_width, window_height))
                 form = cmds.formLayout(parent=window)
                 meditor = cmds.modelEditor(parent=form)
                 cmds.formLayout(form, edit=True, attachForm=[
@@ -302,196 +392,188 @@ class Proj2Tex:
                     (meditor, 'bottom', 0),
                     (meditor, 'right', 0)
                 ])
+                # viewSelected isolates the current selection
+                cmds.select(all_geom)
                 cmds.modelEditor(meditor, edit=True, activeView=True, camera=scr_cam, displayAppearance='wireframe',
                                  headsUpDisplay=False, handles=False, grid=False, manipulators=False, viewSelected=True)
                 cmds.showWindow(window)
                 cmds.window(window, edit=True, width=window_width, height=window_height)
-                if i == 0:
-                    cmds.deleteUI(meditor)
-                    cmds.deleteUI(window)
-            view = OpenMayaUI.M3dView()
-            OpenMayaUI.M3dView.getM3dViewFromModelEditor(meditor, view)
+                cmds.refresh(force=True)
+                return window, meditor
+            window, meditor = build_window()
+            view = OpenMayaUI.M3dView.getM3dViewFromModelEditor(meditor)
+            # construct the window twice in order to address issues when changing the screenshot size
+            if view.portWidth() != window_width or view.portHeight() != window_height:
+                cmds.deleteUI(meditor)
+                cmds.deleteUI(window)
+                window, meditor = build_window()
+                view = OpenMayaUI.M3dView.getM3dViewFromModelEditor(meditor)
             viewWidth = view.portWidth()
             viewHeight = view.portHeight()
-            view.refresh(False, True)
+            ss_scale_x = self.screenshot_res/viewWidth
+            ss_scale_y = self.screenshot_res/viewHeight
+            view_top = viewHeight - 1
             for proj in self.projections:
-                cmds.setAttr(scr_cam + '.rotateX', cmds.getAttr(proj.place3dTexture() + '.rotateX'))
-                cmds.setAttr(scr_cam + '.rotateY', cmds.getAttr(proj.place3dTexture() + '.rotateY'))
-                cmds.setAttr(scr_cam + '.rotateZ', cmds.getAttr(proj.place3dTexture() + '.rotateZ'))
-
-                cmds.select(all=True)
-                cmds.modelEditor(meditor, edit=True, removeSelected=True)
-                view.refresh(False, True)
+                cmds.xform(scr_cam, rotation=cmds.xform(proj.place3dTexture(), q=True, rotation=True, objectSpace=True),
+                           objectSpace=True)
 
-                cmds.select(self._get_all_target_geometry())
-                cmds.select(proj.place3dTexture(), add=True)
+                cmds.select(all_geom + [proj.place3dTexture()])
                 cmds.modelEditor(meditor, edit=True, addSelected=True)
+                view.refresh(False, True)
                 cmds.viewFit(scr_cam, fitFactor=0.95)
 
+                cmds.select(proj.place3dTexture())
                 cmds.modelEditor(meditor, edit=True, removeSelected=True)
-                cmds.select(self._get_all_target_geometry())
-                cmds.modelEditor(meditor, edit=True, addSelected=True)
                 cmds.select(clear=True)
 
-                cmds.playblast(filename=proj.image_path + '.tmp', startTime=1, endTime=1, viewer=False, format='image',
-                               offScreen=True, compression=os.path.splitext(proj.image_path)[1][1:],
+                tmp_image_stem = os.path.join(tmp_dir, proj.name)
+                cmds.playblast(filename=tmp_image_stem, startTime=1, endTime=1, viewer=False, format='image',
+                               offScreen=True, compression=_SCREENSHOT_TMP_FORMAT,
                                editorPanelName=meditor, width=self.screenshot_res, height=self.screenshot_res,
                                p=100, forceOverwrite=True)
-                tmp_image_path = proj.image_path + '.tmp.0001' + os.path.splitext(proj.image_path)[1]
+                tmp_image_path = tmp_image_stem + '.0001.' + _SCREENSHOT_TMP_FORMAT
 
                 view.refresh(False, True)
-                if proj.direction == DIRECTION_FRONT:
-                    if proj.flip:
-                        crop_xmin, crop_ymin, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmax, ymin, (zmin+zmax)/2.0])
-                        assert unclipped
-                        crop_xmax, crop_ymax, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmin, ymax, (zmin+zmax)/2.0])
-                        assert unclipped    
-                    else:
-                        crop_xmin, crop_ymin, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmin, ymin, (zmin+zmax)/2.0])
-                        assert unclipped
-                        crop_xmax, crop_ymax, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmax, ymax, (zmin+zmax)/2.0])
-                        assert unclipped
-                elif proj.direction == DIRECTION_BACK:
-                    if proj.flip:
-                        crop_xmin, crop_ymin, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmin, ymin, (zmin+zmax)/2.0])
-                        assert unclipped
-                        crop_xmax, crop_ymax, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmax, ymax, (zmin+zmax)/2.0])
-                        assert unclipped
-                    else:
-                        crop_xmin, crop_ymin, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmax, ymin, (zmin+zmax)/2.0])
-                        assert unclipped
-                        crop_xmax, crop_ymax, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmin, ymax, (zmin+zmax)/2.0])
-                        assert unclipped
-                elif proj.direction == DIRECTION_SIDE:
-                    if proj.flip:
-                        crop_xmin, crop_ymin, unclipped = Proj2Tex._world_to_viewport_pt(view, [(xmin+xmax)/2.0, ymin, zmin])
-                        assert unclipped
-                        crop_xmax, crop_ymax, unclipped = Proj2Tex._world_to_viewport_pt(view, [(xmin+xmax)/2.0, ymax, zmax])
-                        assert unclipped
-                    else:
-                        crop_xmin, crop_ymin, unclipped = Proj2Tex._world_to_viewport_pt(view, [(xmin+xmax)/2.0, ymin, zmax])
-                        assert unclipped
-                        crop_xmax, crop_ymax, unclipped = Proj2Tex._world_to_viewport_pt(view, [(xmin+xmax)/2.0, ymax, zmin])
-                        assert unclipped
-                elif proj.direction == DIRECTION_TOP:
-                    if proj.flip:
-                        crop_xmin, crop_ymin, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmin, (ymin+ymax)/2.0, zmin])
-                        assert unclipped
-                        crop_xmax, crop_ymax, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmax, (ymin+ymax)/2.0, zmax])
-                        assert unclipped
-                    else:
-                        crop_xmin, crop_ymin, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmin, (ymin+ymax)/2.0, zmax])
-                        assert unclipped
-                        crop_xmax, crop_ymax, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmax, (ymin+ymax)/2.0, zmin])
-                        assert unclipped
-                elif proj.direction == DIRECTION_BOTTOM:
-                    if proj.flip:
-                        crop_xmin, crop_ymin, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmin, (ymin+ymax)/2.0, zmax])
-                        assert unclipped
-                        crop_xmax, crop_ymax, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmax, (ymin+ymax)/2.0, zmin])
-                        assert unclipped
-                    else:
-                        crop_xmin, crop_ymin, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmin, (ymin+ymax)/2.0, zmin])
-                        assert unclipped
-                        crop_xmax, crop_ymax, unclipped = Proj2Tex._world_to_viewport_pt(view, [xmax, (ymin+ymax)/2.0, zmax])
-                        assert unclipped
+                corner_min, corner_max = crop_corners[(proj.direction, bool(proj.flip))]
+                crop_xmin, crop_ymin, min_unclipped = Proj2Tex._world_to_viewport_pt(view, corner_min)
+                crop_xmax, crop_ymax, max_unclipped = Proj2Tex._world_to_viewport_pt(view, corner_max)
+                if not (min_unclipped and max_unclipped):
+                    raise Exception('projection \'{}\' does not fit in the screenshot view'.format(proj.name))
+
+                ss_crop_xmin = crop_xmin*ss_scale_x
+                ss_crop_ymin = (view_top - crop_ymax)*ss_scale_y
+                ss_crop_xmax = crop_xmax*ss_scale_x
+                ss_crop_ymax = (view_top - crop_ymin)*ss_scale_y
+
+                crop_box = tuple(min(max(int(round(v)), 0), self.screenshot_res)
+                                 for v in (ss_crop_xmin, ss_crop_ymin, ss_crop_xmax, ss_crop_ymax))
+                if conv_cmd is None:
+                    pending_crops.append(crop_executor.submit(Proj2Tex._crop_image, tmp_image_path, proj.image_path, crop_box))
                 else:
-                    raise Exception('unrecognized projection direction \'{}'.format(proj.direction) + '\', valid options are: {}'.format(proj.direction, VALID_DIRECTIONS))
-
-                ss_crop_xmin = crop_xmin/viewWidth * self.screenshot_res
-                ss_crop_ymin = (viewHeight - crop_ymax - 1)/viewHeight * self.screenshot_res
-                ss_crop_xmax = crop_xmax/viewWidth * self.screenshot_res
-                ss_crop_ymax = (viewHeight - crop_ymin - 1)/viewHeight * self.screenshot_res
+                    magick_crops.append((tmp_image_path, proj.image_path, crop_box))
 
-                conv_cmd, magick_env = self._find_magick_convert() 
-                subprocess.run(conv_cmd + [tmp_image_path, '-crop',
-                                '{}x{}+{}+{}'.format(ss_crop_xmax - ss_crop_xmin, ss_crop_ymax - ss_crop_ymin, ss_crop_xmin, ss_crop_ymin),
-                                proj.image_path], env={**os.environ, **magick_env}, check=True)
+            for crop in pending_crops:
+                crop.result()
+            if len(magick_crops) > 0:
+                Proj2Tex._crop_images_magick(magick_crops, conv_cmd, magick_env)
 
+        finally:
+            crop_executor.shutdown(wait=True)
+            try:
+                cmds.deleteUI(meditor)
+                cmds.deleteUI(window)
+                cmds.delete(scr_cam)
+            finally:
                 try:
-                    os.remove(tmp_image_path)
+                    shutil.rmtree(tmp_dir)
                 except:
-                    print('Warning: Failed to discard temporary screenshot image: {}'.format(tmp_image_path))
-
-        finally:
-            cmds.deleteUI(meditor)
-            cmds.deleteUI(window)
-            cmds.delete(scr_cam)
+                    print('Warning: Failed to discard temporary screenshot images: {}'.format(tmp_dir))
 
     def _layered_shader(self):
-        return 'layered_shader{}'.format(hash(frozenset(self._get_all_target_geometry())) % 100000)
-
+        # hash() differs between sessions, so use a stable digest
+        if self._layered_shader_cache is None:
+            geom_names = '|'.join(sorted(self._get_all_target_geometry()))
+            self._layered_shader_cache = 'layered_shader_{}'.format(
+                hashlib.blake2b(geom_names.encode('utf-8'), digest_size=6).hexdigest())
+        return self._layered_shader_cache
+
+    @_fast_maya_context()
     def make_layered_shader(self):
-        for proj in self.projections:
-            cmds.shadingNode('file', name=proj.file(), asTexture=True, isColorManaged=True)
-            cmds.setAttr(proj.file() + '.fileTextureName', proj.image_path, type='string')
+        for proj in self._layer_projections:
+            proj_file = proj.file()
+            cmds.shadingNode('file', name=proj_file, asTexture=True, isColorManaged=True, skipSelect=True)
+            cmds.setAttr(proj_file + '.fileTextureName', proj.image_path, type='string')
             if not os.path.exists(proj.image_path):
                 cmds.confirmDialog(title='Error: Projection image not found', message='The image \'{}\' does not exist'.format(proj.image_path), button='OK')
-            cmds.connectAttr(proj.file() + '.outColor', proj.projection() + '.image', f=True)
-        cmds.shadingNode('layeredShader', name=self._layered_shader(), asShader=True)
-        cmds.setAttr(self._layered_shader() + '.compositingFlag', 1)
-        for index in range(len(self.layers)):
-            l = self.layers[index]
-            cmds.shadingNode('lambert', name=l.layer_material(), asShader=True)
-            self._configure_lambert_material(l.layer_material())
+            cmds.connectAttr(proj_file + '.outColor', proj.projection() + '.image', f=True)
+        layered_shader = self._layered_shader()
+        cmds.shadingNode('layeredShader', name=layered_shader, asShader=True, skipSelect=True)
+        cmds.setAttr(layered_shader + '.compositingFlag', 1)
+        for index, l in enumerate(self.layers):
+            layer_mat = l.layer_material()
+            cmds.shadingNode('lambert', name=layer_mat, asShader=True, skipSelect=True)
+            self._configure_lambert_material(layer_mat)
             color_proj = self._find_projection_by_name(l.color_proj_name)
-            cmds.connectAttr(color_proj.projection() + '.outColor', l.layer_material() + '.color', f=True)
+            cmds.connectAttr(color_proj.projection() + '.outColor', layer_mat + '.color', f=True)
             if l.transparency_proj_name is not None:
                 transp_proj = self._find_projection_by_name(l.transparency_proj_name)
-                cmds.connectAttr(transp_proj.projection() + '.outColor', l.layer_material() + '.transparency', f=True)
-            layer_mat = l.layer_material()
-            cmds.connectAttr(layer_mat + '.outColor', self._layered_shader() + '.inputs[{}].color'.format(index), f=True)
-            cmds.connectAttr(layer_mat + '.outTransparency', self._layered_shader() + '.inputs[{}].transparency'.format(index), f=True)
+                cmds.connectAttr(transp_proj.projection() + '.outColor', layer_mat + '.transparency', f=True)
+            cmds.connectAttr(layer_mat + '.outColor', layered_shader + '.inputs[{}].color'.format(index), f=True)
+            cmds.connectAttr(layer_mat + '.outTransparency', layered_shader + '.inputs[{}].transparency'.format(index), f=True)
+        geom_targets = []
         for target in self.targets:
             if Proj2Tex.is_target_shader(target):
-                cmds.connectAttr('{}.outColor'.format(self._layered_shader()), '{}.color'.format(target))
+                cmds.connectAttr('{}.outColor'.format(layered_shader), '{}.color'.format(target))
             else:
-                cmds.select(target)
-                cmds.hyperShade(assign=self._layered_shader())
+                geom_targets.append(target)
+        if len(geom_targets) > 0:
+            Proj2Tex._assign_shader(layered_shader, geom_targets)
 
+    @_fast_maya_context()
     def convert(self):
         self._clear_layered_shader()
+        if len(self.layers) == 0:
+            return
         all_geom = self._get_all_target_geometry()
-        for proj in self.projections:
+        baked_file_nodes = []
+        bake_flags = dict(
+            antiAlias=False, backgroundMode=1, fillTextureSeams=self.fill_texture_seams, force=True,
+            samplePlane=False, shadows=False, alpha=False, doubleSided=False, componentRange=False,
+            resolutionX=self.baked_texture_res[0], resolutionY=self.baked_texture_res[1])
+        for proj in self._layer_projections:
+            proj_color = proj.projection() + '.outColor'
             for geom in all_geom:
-                file_image_name = proj.baked_image_path(geom)
-                file_format = os.path.splitext(file_image_name)[1][1:]
-                cmds.convertSolidTx(proj.projection() + '.outColor', geom,
-                    antiAlias=False, backgroundMode=1, fillTextureSeams=self.fill_texture_seams, force=True,
-                    samplePlane=False, shadows=False, alpha=False, doubleSided=False, componentRange=False,
-                    resolutionX=self.baked_texture_res[0], resolutionY=self.baked_texture_res[1],
-                    fileFormat=file_format, fileImageName=file_image_name)
+                baked_file_nodes += cmds.convertSolidTx(proj_color, geom, fileFormat=proj.image_format,
+                    fileImageName=proj.baked_image_path(geom), **bake_flags) or []
+        if len(baked_file_nodes) > 0:
+            Proj2Tex._delete_existing(baked_file_nodes)
 
     def _combined_image_path(self, geom):
-        file_fmt = os.path.splitext(self.combined_image_path)[1][1:]
-        return os.path.splitext(self.combined_image_path)[0] + '_{}.{}'.format(geom, file_fmt)
+        return '{}_{}.{}'.format(self._combined_image_stem, geom, self._combined_image_format)
+
+    @staticmethod
+    def _load_image(path, mode):
+        with Image.open(path) as img:
+            return img.convert(mode)
 
     def combine(self):
-        tmp_images = []
-        try:
-            for geom in self._get_all_target_geometry():
-                combined_img_path = self._combined_image_path(geom)
-                file_fmt = os.path.splitext(combined_img_path)[1][1:]
-                img = self._find_projection_by_name(self.layers[len(self.layers)-1].color_proj_name).baked_image_path(geom)
-                for i in range(len(self.layers)-2, -1, -1):
-                    l = self.layers[i]
-                    color_img = self._find_projection_by_name(l.color_proj_name).baked_image_path(geom)
-                    if l.transparency_proj_name is None:
-                        img = color_img
-                    else:
-                        transp_img = self._find_projection_by_name(l.transparency_proj_name).baked_image_path(geom)
-                        output_path = os.path.splitext(combined_img_path)[0] + '.tmp{}.'.format(i) + file_fmt
-                        conv_cmd, magick_env = self._find_magick_convert()
-                        subprocess.run(conv_cmd + ['-composite', color_img, img, transp_img, output_path], check=True, env={**os.environ, **magick_env})
-                        tmp_images.append(output_path)
-                        img = output_path
-                shutil.copy(img, combined_img_path)
-        finally:
-            for path in tmp_images:
-                try:
-                    os.remove(path)
-                except:
-                    print('Warning: Failed to discard temporary image: {}'.format(path))
+        # a layer without transparency hides every layer below it
+        base_index = len(self.layers)-1
+        for i in range(len(self.layers)-1):
+            if self.layers[i].transparency_proj_name is None:
+                base_index = i
+                break
+        conv_cmd, magick_env = self._find_magick_convert() if Image is None and base_index > 0 else (None, None)
+        base_proj = self._find_projection_by_name(self.layers[base_index].color_proj_name)
+        composite_projs = [(self._find_projection_by_name(self.layers[i].color_proj_name),
+                            self._find_projection_by_name(self.layers[i].transparency_proj_name))
+                           for i in range(base_index-1, -1, -1)]
+        def combine_geometry(geom):
+            combined_img_path = self._combined_image_path(geom)
+            base_img = base_proj.baked_image_path(geom)
+            composites = [(color_proj.baked_image_path(geom), transp_proj.baked_image_path(geom))
+                          for color_proj, transp_proj in composite_projs]
+            if len(composites) == 0:
+                shutil.copy(base_img, combined_img_path)
+            elif Image is not None:
+                # white areas of the transparency image show the layers below
+                loaded = {}
+                def load(path, mode):
+                    if (path, mode) not in loaded:
+                        loaded[(path, mode)] = Proj2Tex._load_image(path, mode)
+                    return loaded[(path, mode)]
+                img = load(base_img, 'RGB')
+                for color_img, transp_img in composites:
+                    img = Image.composite(img, load(color_img, 'RGB'), load(transp_img, 'L'))
+                img.save(combined_img_path)
+            else:
+                args = [base_img]
+                for color_img, transp_img in composites:
+                    args += [color_img, transp_img, '-swap', '0,1', '-composite']
+                subprocess.run(conv_cmd + args + [combined_img_path], check=True, env={**os.environ, **magick_env})
+        all_geom = self._get_all_target_geometry()
+        with ThreadPoolExecutor(max_workers=max(1, min(len(all_geom), os.cpu_count() or 1))) as executor:
+            list(executor.map(combine_geometry, all_geom))
 
     def _shader(self, geom):
         return '{}_shader'.format(geom)
@@ -499,58 +581,104 @@ class Proj2Tex:
     def _shader_file(self, geom):
         return '{}_file'.format(geom)
 
+    @_fast_maya_context()
     def apply_to_shaders(self):
+        target_geometry = self._get_target_geometry_map()
         for geom in self._get_all_target_geometry():
-            cmds.shadingNode('file', name=self._shader_file(geom), asTexture=True, isColorManaged=True)
+            cmds.shadingNode('file', name=self._shader_file(geom), asTexture=True, isColorManaged=True, skipSelect=True)
             cmds.setAttr(self._shader_file(geom) + '.fileTextureName', self._combined_image_path(geom), type='string')
             shader_created = False
             for target in self.targets:
-                if Proj2Tex.get_target_geometry(target) == geom:
+                if target_geometry[target] == geom:
                     if Proj2Tex.is_target_shader(target):
                         tgt_shader = target
                     else:
                         if not shader_created:
-                            cmds.shadingNode('lambert', name=self._shader(geom), asShader=True)
+                            cmds.shadingNode('lambert', name=self._shader(geom), asShader=True, skipSelect=True)
                             self._configure_lambert_material(self._shader(geom))
                             shader_created = True
                         tgt_shader = self._shader(geom)
                     cmds.connectAttr(self._shader_file(geom) + '.outColor', tgt_shader + '.color', f=True)
             if shader_created:
-                cmds.select(geom)
-                cmds.hyperShade(assign=self._shader(geom))
+                Proj2Tex._assign_shader(self._shader(geom), geom)
+        self._invalidate_target_geometry()
         self._clear_projections()
 
+# ElementTree.indent requires Python 3.9
+def _indent_xml(elem, level=0):
+    if level == 0 and hasattr(ET, 'indent'):
+        ET.indent(elem, space='\t')
+        return
+    if len(elem) == 0:
+        return
+    child_indent = '\n' + '\t' * (level + 1)
+    if not elem.text or not elem.text.strip():
+        elem.text = child_indent
+    for child in elem:
+        _indent_xml(child, level + 1)
+        if not child.tail or not child.tail.strip():
+            child.tail = child_indent
+    child.tail = '\n' + '\t' * level
+
+def _sub_element(parent, tag, text):
+    elem = ET.SubElement(parent, tag)
+    elem.text = text
+    return elem
+
+def _sub_resolution(parent, tag, width, height):
+    elem = ET.SubElement(parent, tag)
+    _sub_element(elem, 'width', str(width))
+    _sub_element(elem, 'height', str(height))
+    return elem
+
+_CONFIG_PROJECTION_ELEM = ('projections', 'projection')
+_CONFIG_LAYER_ELEM = ('layers', 'layer')
+
 def parse_config(config_path):
     def abs_path(path):
         return os.path.join(os.path.dirname(config_path), path)
-    tree = ET.parse(config_path)
-    root = tree.getroot()
+    def child_texts(elem):
+        return {c.tag: c.text for c in elem}
+    settings = dict()
     projections = []
-    for proj_elem in root.findall('./projections/projection'):
-        flip_elem = proj_elem.find('flip')
-        proj = Projection(proj_elem.find('name').text,
-                          proj_elem.find('direction').text,
-                          flip_elem.text == 'True' if flip_elem is not None else False,
-                          abs_path(proj_elem.find('imagePath').text))
-        projections.append(proj)
     layers = []
-    for layer_elem in root.findall('./layers/layer'):
-        transp = layer_elem.find('transparencyProjectionName')
-        layer = Layer(layer_elem.find('name').text,
-                      layer_elem.find('colorProjectionName').text,
-                      transp.text if transp is not None else None)
-        layers.append(layer)
-    combined_image_path = abs_path(root.find('./combinedImagePath').text)
+    open_elems = []
+    for event, elem in ET.iterparse(config_path, events=('start', 'end')):
+        if event == 'start':
+            open_elems.append(elem)
+            continue
+        open_elems.pop()
+        if len(open_elems) == 0:
+            continue
+        parent = open_elems[-1]
+        elem_key = (parent.tag, elem.tag)
+        if elem_key == _CONFIG_PROJECTION_ELEM:
+            fields = child_texts(elem)
+            proj = Projection(fields['name'],
+                              fields['direction'],
+                              fields.get('flip') == 'True',
+                              abs_path(fields['imagePath']))
+            projections.append(proj)
+            parent.remove(elem)
+        elif elem_key == _CONFIG_LAYER_ELEM:
+            fields = child_texts(elem)
+            layer = Layer(fields['name'],
+                          fields['colorProjectionName'],
+                          fields.get('transparencyProjectionName'))
+            layers.append(layer)
+            parent.remove(elem)
+        elif len(open_elems) == 1:
+            settings[elem.tag] = elem
+    combined_image_path = abs_path(settings['combinedImagePath'].text)
     config = dict(
         projections=projections, layers=layers,
         combined_image_path=combined_image_path)
-    projection_padding_elem = root.find('./projectionPaddingPercentage')
-    screenshot_res_elem = root.find('./screenshotResolution')
-    baked_tex_res_elem = root.find('./bakedTextureResolution')
-    fill_texture_seams_elem = root.find('./fillTextureSeams')
-    config['projection_padding'] = float(projection_padding_elem.text)/100.0
-    config['screenshot_res'] = int(screenshot_res_elem.find('./width').text)
-    config['baked_texture_res'] = (int(baked_tex_res_elem.find('./width').text), int(baked_tex_res_elem.find('./height').text))
+    screenshot_res = child_texts(settings['screenshotResolution'])
+    baked_tex_res = child_texts(settings['bakedTextureResolution'])
+    fill_texture_seams_elem = settings.get('fillTextureSeams')
+    config['projection_padding'] = float(settings['projectionPaddingPercentage'].text)/100.0
+    config['screenshot_res'] = int(screenshot_res['width'])
+    config['baked_texture_res'] = (int(baked_tex_res['width']), int(baked_tex_res['height']))
     config['fill_texture_seams'] = fill_texture_seams_elem.text == 'True' if fill_texture_seams_elem is not None else True
     return config
 
@@ -657,10 +785,11 @@ def run():
             return
         path = os.path.abspath(path)
         cmds.textField(outputDirTextField, edit=True, text=path)
-        if os.path.exists(getConfigPath()):
+        configPath = configPathIn(path)
+        if os.path.exists(configPath):
             loadConfig()
             cmds.confirmDialog(title='Loaded Existing Configuration',
-                               message='Loaded existing configuration found at {}'.format(getConfigPath()),
+                               message='Loaded existing configuration found at {}'.format(configPath),
                                button='OK')
         for btn in p2tButtons:
             cmds.button(btn, edit=True, enable=True)
@@ -705,6 +834,12 @@ def run():
         ProjControl('Top', DIRECTION_TOP, topCheckBox, topColorTextField, topAlphaTextField, topFlipCheckBox),
         ProjControl('Bottom', DIRECTION_BOTTOM, bottomCheckBox, bottomColorTextField, bottomAlphaTextField, bottomFlipCheckBox)
     ]
+    ProjState = namedtuple('ProjState', ['enabled', 'flip', 'colorPath', 'alphaPath'])
+    colorProjNameOf = {pc.name: '{}ColorProj'.format(pc.name) for pc in projControls}
+    alphaProjNameOf = {pc.name: '{}AlphaProj'.format(pc.name) for pc in projControls}
+    projMenuItemByName = {pc.name: i+2 for i, pc in enumerate(projControls)}
+    projMenuItemByProjName = {colorProjNameOf[pc.name]: i+2 for i, pc in enumerate(projControls)}
+    projMenuItemByProjName.update({alphaProjNameOf[pc.name]: i+2 for i, pc in enumerate(projControls)})
 
     row = cmds.rowLayout(parent=configColumn, numberOfColumns=2, columnWidth2=(150, 150), columnAttach2=('both', 'both'))
     cmds.text(parent=row, label='Projection Padding (%):')
@@ -716,22 +851,20 @@ def run():
     cmds.text(parent=grid, label='Layers')
     cmds.text(parent=grid, label='Color')
     cmds.text(parent=grid, label='Alpha')
+    projMenuLabels = [''] + [pc.name for pc in projControls]
+    def makeProjMenu():
+        menu = cmds.optionMenu(parent=grid)
+        for label in projMenuLabels:
+            cmds.menuItem(label=label, parent=menu)
+        return menu
     layerControls = []
     maxLayers = 4
     for i in range(maxLayers):
         cmds.text(parent=grid, label='Layer {}'.format(i+1))
-        layerColorMenu = cmds.optionMenu(parent=grid)
-        cmds.menuItem(label='', parent=layerColorMenu)
-        for pc in projControls:
-            cmds.menuItem(label=pc.name, parent=layerColorMenu)
-        layerAlphaMenu = cmds.optionMenu(parent=grid)
-        cmds.menuItem(label='', parent=layerAlphaMenu)
-        for pc in projControls:
-            cmds.menuItem(label=pc.name, parent=layerAlphaMenu)
-        layerControls.append(LayerControl(layerColorMenu, layerAlphaMenu))
-    cmds.optionMenu(layerControls[0].colorMenu, edit=True, select=[i for i in range(len(projControls)) if projControls[i].name == 'Front'][0]+2)
-    cmds.optionMenu(layerControls[0].alphaMenu, edit=True, select=[i for i in range(len(projControls)) if projControls[i].name == 'Side'][0]+2)
-    cmds.optionMenu(layerControls[1].colorMenu, edit=True, select=[i for i in range(len(projControls)) if projControls[i].name == 'Back'][0]+2)
+        layerControls.append(LayerControl(makeProjMenu(), makeProjMenu()))
+    cmds.optionMenu(layerControls[0].colorMenu, edit=True, select=projMenuItemByName['Front'])
+    cmds.optionMenu(layerControls[0].alphaMenu, edit=True, select=projMenuItemByName['Side'])
+    cmds.optionMenu(layerControls[1].colorMenu, edit=True, select=projMenuItemByName['Back'])
 
     row = cmds.rowLayout(parent=configColumn, numberOfColumns=2, columnWidth2=(150, 150), columnAttach2=('both', 'both'))
     cmds.text(parent=row, label='Combined Image Name:')
@@ -756,50 +889,57 @@ def run():
             return None
         return os.path.abspath(outdir)
 
+    def configPathIn(outdir):
+        return os.path.join(outdir, 'config.xml')
+
     def getConfigPath():
         outdir = getOutputDirectory()
         if outdir is None:
             return None
-        return os.path.join(outdir, 'config.xml')
+        return configPathIn(outdir)
 
     def loadConfig():
         outdir = getOutputDirectory()
-        configPath = getConfigPath()
+        configPath = configPathIn(outdir)
         def relativizePath(path):
             return os.path.relpath(os.path.abspath(path), outdir)
         cfg = parse_config(configPath)
         # load projections
+        projByName = {proj.name: proj for proj in cfg['projections']}
         for pc in projControls:
-            projPresent = False
-            colorProjName = '{}ColorProj'.format(pc.name)
-            alphaProjName = '{}AlphaProj'.format(pc.name)
-            cmds.textField(pc.colorTextField, edit=True, text='')
-            cmds.textField(pc.alphaTextField, edit=True, text='')
-            for proj in cfg['projections']:
-                if proj.direction == pc.direction:
-                    if proj.name == colorProjName:
-                        projPresent = True
-                        cmds.textField(pc.colorTextField, edit=True, text=relativizePath(proj.image_path))
-                    elif proj.name == alphaProjName:
-                        projPresent = True
-                        cmds.textField(pc.alphaTextField, edit=True, text=relativizePath(proj.image_path))
-                    cmds.checkBox(pc.flipCheckBox, edit=True, value=proj.flip)
+            colorProj = projByName.get(colorProjNameOf[pc.name])
+            if colorProj is not None and colorProj.direction != pc.direction:
+                colorProj = None
+            alphaProj = projByName.get(alphaProjNameOf[pc.name])
+            if alphaProj is not None and alphaProj.direction != pc.direction:
+                alphaProj = None
+            projPresent = colorProj is not None or alphaProj is not None
+            colorPath = relativizePath(colorProj.image_path) if colorProj is not None else ''
+            alphaPath = relativizePath(alphaProj.image_path) if alphaProj is not None else ''
+            # alpha flip takes precedence
+            flip = None
+            for proj in (colorProj, alphaProj):
+                if proj is not None:
+                    flip = proj.flip
+            cmds.textField(pc.colorTextField, edit=True, text=colorPath)
+            cmds.textField(pc.alphaTextField, edit=True, text=alphaPath)
+            if flip is not None:
+                cmds.checkBox(pc.flipCheckBox, edit=True, value=flip)
             cmds.checkBox(pc.checkBox, edit=True, value=projPresent)
         # load layers
         layers = cfg['layers']
         numLayers = len(layers)
-        for lc in layerControls:
-            cmds.optionMenu(lc.colorMenu, edit=True, select=1)
-            cmds.optionMenu(lc.alphaMenu, edit=True, select=1)
-        for i in range(numLayers):
-            lc = layerControls[i]
-            colorProjName = layers[numLayers-i-1].color_proj_name
-            colorProjSel = [i for i in range(len(projControls)) if '{}ColorProj'.format(projControls[i].name) == colorProjName][0]+2
-            cmds.optionMenu(lc.colorMenu, edit=True, select=colorProjSel)
+        for i, lc in enumerate(layerControls):
+            colorProjSel = 1
+            alphaProjSel = 1
+            if i < numLayers:
+                colorProjName = layers[numLayers-i-1].color_proj_name
+                colorProjSel = projMenuItemByProjName[colorProjName]
             if i < numLayers-1:
                 alphaProjName = layers[numLayers-i-2].transparency_proj_name
-                alphaProjSel = [i for i in range(len(projControls)) if '{}AlphaProj'.format(projControls[i].name) == alphaProjName][0]+2
-                cmds.optionMenu(lc.alphaMenu, edit=True, select=alphaProjSel)
+                alphaProjSel = projMenuItemByProjName[alphaProjName]
+            cmds.optionMenu(lc.colorMenu, edit=True, select=colorProjSel)
+            cmds.optionMenu(lc.alphaMenu, edit=True, select=alphaProjSel)
         # load remaining settings
         cmds.textField(combinedTextField, edit=True, text=relativizePath(cfg['combined_image_path']))
         cmds.textField(projectionPaddingTextField, edit=True, text=str(cfg['projection_padding']*100.0))
@@ -811,72 +951,116 @@ def run():
     class ConfigGenerationError(Exception):
         pass
 
-    def generateConfig():
-        proj2tex = ET.Element('proj2tex')
+    ConfigControls = namedtuple('ConfigControls', [
+        'projStates', 'layerSels', 'combinedImagePath', 'projectionPadding', 'screenshotRes',
+        'convertedResWidth', 'convertedResHeight', 'fillTextureSeams'])
+    lastConfig = {'key': None, 'config': None}
 
-        projections = ET.SubElement(proj2tex, 'projections')
+    def readConfigControls():
+        projStates = []
         for pc in projControls:
             if cmds.checkBox(pc.checkBox, q=True, value=True):
-                flip = cmds.checkBox(pc.flipCheckBox, q=True, value=True)
-                colorPath = cmds.textField(pc.colorTextField, q=True, text=True).strip()
-                if len(colorPath) > 0:
+                projStates.append(ProjState(True,
+                                            cmds.checkBox(pc.flipCheckBox, q=True, value=True),
+                                            cmds.textField(pc.colorTextField, q=True, text=True).strip(),
+                                            cmds.textField(pc.alphaTextField, q=True, text=True).strip()))
+            else:
+                projStates.append(ProjState(False, False, '', ''))
+        layerSels = []
+        for lc in layerControls:
+            colorSel = cmds.optionMenu(lc.colorMenu, q=True, select=True)
+            if colorSel > 1:
+                layerSels.append((colorSel, cmds.optionMenu(lc.alphaMenu, q=True, select=True)))
+        return ConfigControls(
+            tuple(projStates), tuple(layerSels),
+            cmds.textField(combinedTextField, q=True, text=True),
+            cmds.textField(projectionPaddingTextField, q=True, text=True).strip(),
+            cmds.textField(screenshotResTextField, q=True, text=True).strip(),
+            cmds.textField(convertedResWidthTextField, q=True, text=True).strip(),
+            cmds.textField(convertedResHeightTextField, q=True, text=True).strip(),
+            cmds.checkBox(fillTextureSeamsCheckbox, q=True, value=True))
+
+    def generateConfig(controls=None, outdir=None):
+        if controls is None:
+            controls = readConfigControls()
+        if outdir is None:
+            outdir = getOutputDirectory()
+        projStates = controls.projStates
+        layerSels = controls.layerSels
+
+        proj2tex = ET.Element('proj2tex')
+        configProjections = []
+        configLayers = []
+
+        colorProjNames = [None] * len(projControls)
+        alphaProjNames = [None] * len(projControls)
+        projections = ET.SubElement(proj2tex, 'projections')
+        for i, (pc, ps) in enumerate(zip(projControls, projStates)):
+            if ps.enabled:
+                flipText = str(ps.flip)
+                if len(ps.colorPath) > 0:
+                    colorProjNames[i] = colorProjNameOf[pc.name]
                     proj = ET.SubElement(projections, 'projection')
-                    ET.SubElement(proj, 'name').text = '{}ColorProj'.format(pc.name)
-                    ET.SubElement(proj, 'direction').text = pc.direction
-                    ET.SubElement(proj, 'imagePath').text = colorPath
-                    ET.SubElement(proj, 'flip').text = str(flip)
-                alphaPath = cmds.textField(pc.alphaTextField, q=True, text=True).strip()
-                if len(alphaPath) > 0:
+                    _sub_element(proj, 'name', colorProjNames[i])
+                    _sub_element(proj, 'direction', pc.direction)
+                    _sub_element(proj, 'imagePath', ps.colorPath)
+                    _sub_element(proj, 'flip', flipText)
+                    configProjections.append(Projection(colorProjNames[i], pc.direction, ps.flip,
+                                                        os.path.join(outdir, ps.colorPath)))
+                if len(ps.alphaPath) > 0:
+                    alphaProjNames[i] = alphaProjNameOf[pc.name]
                     proj = ET.SubElement(projections, 'projection')
-                    ET.SubElement(proj, 'name').text = '{}AlphaProj'.format(pc.name)
-                    ET.SubElement(proj, 'direction').text = pc.direction
-                    ET.SubElement(proj, 'imagePath').text = alphaPath
-                    ET.SubElement(proj, 'flip').text = str(flip)
+                    _sub_element(proj, 'name', alphaProjNames[i])
+                    _sub_element(proj, 'direction', pc.direction)
+                    _sub_element(proj, 'imagePath', ps.alphaPath)
+                    _sub_element(proj, 'flip', flipText)
+                    configProjections.append(Projection(alphaProjNames[i], pc.direction, ps.flip,
+                                                        os.path.join(outdir, ps.alphaPath)))
 
         layers = ET.SubElement(proj2tex, 'layers')
-        activeLayerControls = [lc for lc in layerControls if cmds.optionMenu(lc.colorMenu, q=True, select=True) > 1]
-        numLayers = len(activeLayerControls)
-
+        numLayers = len(layerSels)
         # re-interpret alphas as transparency
         for i in range(numLayers):
-            colorProjSel = cmds.optionMenu(activeLayerControls[numLayers-i-1].colorMenu, q=True, select=True)
-            colorProjControls = projControls[colorProjSel-2]
-            colorProjName = '{}ColorProj'.format(colorProjControls.name)
-            if not cmds.checkBox(colorProjControls.checkBox, q=True, value=True) or len(cmds.textField(colorProjControls.colorTextField, q=True, text=True).strip()) == 0:
+            colorProjName = colorProjNames[layerSels[numLayers-i-1][0]-2]
+            if colorProjName is None:
                 raise ConfigGenerationError('Layer {} refers to a non-existent color projection'.format(numLayers-i))
             if i < numLayers - 1:
-                alphaProjSel = cmds.optionMenu(activeLayerControls[numLayers-i-2].alphaMenu, q=True, select=True)
+                alphaProjSel = layerSels[numLayers-i-2][1]
                 if alphaProjSel <= 1:
                     raise ConfigGenerationError('All layers, except for the last layer, must have alpha defined')
-                alphaProjControls = projControls[alphaProjSel-2]
-                if not cmds.checkBox(alphaProjControls.checkBox, q=True, value=True) or len(cmds.textField(alphaProjControls.alphaTextField, q=True, text=True).strip()) == 0:
+                alphaProjName = alphaProjNames[alphaProjSel-2]
+                if alphaProjName is None:
                     raise ConfigGenerationError('Layer {} refers to a non-existent alpha projection'.format(numLayers-i-1))
-                alphaProjName = '{}AlphaProj'.format(alphaProjControls.name)
             else:
                 alphaProjName = None
             layer = ET.SubElement(layers, 'layer')
-            ET.SubElement(layer, 'name').text = 'Layer{}'.format(i+1)
-            ET.SubElement(layer, 'colorProjectionName').text = colorProjName
+            _sub_element(layer, 'name', 'Layer{}'.format(i+1))
+            _sub_element(layer, 'colorProjectionName', colorProjName)
             if alphaProjName is not None:
-                ET.SubElement(layer, 'transparencyProjectionName').text = alphaProjName
+                _sub_element(layer, 'transparencyProjectionName', alphaProjName)
+            configLayers.append(Layer('Layer{}'.format(i+1), colorProjName, alphaProjName))
 
-        ET.SubElement(proj2tex, 'combinedImagePath').text = cmds.textField(combinedTextField, q=True, text=True)
+        projectionPadding = float(controls.projectionPadding)
+        screenshotRes = int(controls.screenshotRes)
+        bakedTextureRes = (int(controls.convertedResWidth), int(controls.convertedResHeight))
 
-        ET.SubElement(proj2tex, 'projectionPaddingPercentage').text = str(float(cmds.textField(projectionPaddingTextField, q=True, text=True).strip()))
+        _sub_element(proj2tex, 'combinedImagePath', controls.combinedImagePath)
+        _sub_element(proj2tex, 'projectionPaddingPercentage', str(projectionPadding))
+        _sub_resolution(proj2tex, 'screenshotResolution', screenshotRes, screenshotRes)
+        _sub_resolution(proj2tex, 'bakedTextureResolution', *bakedTextureRes)
+        _sub_element(proj2tex, 'fillTextureSeams', str(controls.fillTextureSeams))
 
-        screenshotResolution = ET.SubElement(proj2tex, 'screenshotResolution')
-        ET.SubElement(screenshotResolution, 'width').text = str(int(cmds.textField(screenshotResTextField, q=True, text=True).strip()))
-        ET.SubElement(screenshotResolution, 'height').text = str(int(cmds.textField(screenshotResTextField, q=True, text=True).strip()))
+        _indent_xml(proj2tex)
+        with open(configPathIn(outdir), 'wb') as f:
+            ET.ElementTree(proj2tex).write(f, encoding='utf-8', xml_declaration=True)
 
-        bakedTextureResolution = ET.SubElement(proj2tex, 'bakedTextureResolution')
-        ET.SubElement(bakedTextureResolution, 'width').text = str(int(cmds.textField(convertedResWidthTextField, q=True, text=True).strip()))
-        ET.SubElement(bakedTextureResolution, 'height').text = str(int(cmds.textField(convertedResHeightTextField, q=True, text=True).strip()))
-
-        ET.SubElement(proj2tex, 'fillTextureSeams').text = str(cmds.checkBox(fillTextureSeamsCheckbox, q=True, value=True))
-
-        s = ET.tostring(proj2tex, 'utf-8')
-        with open(getConfigPath(), 'w') as f:
-            f.write(minidom.parseString(s).toprettyxml(indent='\t'))
+        return dict(
+            projections=configProjections, layers=configLayers,
+            combined_image_path=os.path.join(outdir, controls.combinedImagePath),
+            projection_padding=projectionPadding/100.0,
+            screenshot_res=screenshotRes,
+            baked_texture_res=bakedTextureRes,
+            fill_texture_seams=controls.fillTextureSeams)
 
 
     def makeP2T():
@@ -884,72 +1068,49 @@ def run():
         if len(targets) == 0:
             cmds.confirmDialog(title='Error: Invalid target', message='At least one target must be specified', button='OK')
             return None
+        # ls reports non-unique names by full path
+        existingTargets = set(cmds.ls(list(targets)) or [])
         for tgt in targets:
-            if not cmds.objExists(tgt):
+            if tgt not in existingTargets and not cmds.objExists(tgt):
                 cmds.confirmDialog(title='Error: Invalid target', message='Specified target \'{}\' does not exist'.format(tgt), button='OK')
                 return None
+        for tgt in targets:
             if Proj2Tex.get_target_geometry(tgt) is None:
                 cmds.confirmDialog(title='Error: Shader not associated with geometry', message='Target shader \'{}\' is not currently assigned to any object'.format(tgt), button='OK')
                 return None
-        if getOutputDirectory() is None:
+        outdir = getOutputDirectory()
+        if outdir is None:
             cmds.confirmDialog(title='Error: Invalid output directory', message='Invalid output directory specified', button='OK')
             return None
-        try:
-            generateConfig()
-        except ConfigGenerationError as e:
-            cmds.confirmDialog(title='Error: Invalid configuration', message='Configuration is invalid: {}'.format(e), button='OK')
-            return None
-        configPath = getConfigPath()
-        assert configPath is not None
-        assert os.path.exists(configPath)
-        return Proj2Tex(targets, **parse_config(configPath))
-
-    def makeProjections(*args):
-        p2t = makeP2T()
-        if p2t is not None:
-            p2t.make_projections()
-
-    def saveScreenshots(*args):
-        p2t = makeP2T()
-        if p2t is not None:
-            p2t.save_screenshots()
-
-    def makeLayeredShader(*args):
-        p2t = makeP2T()
-        if p2t is not None:
-            p2t.make_layered_shader()
-
-    def convert(*args):
-        p2t = makeP2T()
-        if p2t is not None:
-            p2t.convert()
-
-    def combine(*args):
-        p2t = makeP2T()
-        if p2t is not None:
-            p2t.combine()
-
-    def applyToShaders(*args):
-        p2t = makeP2T()
-        if p2t is not None:
-            p2t.apply_to_shaders()
-
-    def reset(*args):
-        p2t = makeP2T()
-        if p2t is not None:
-            p2t.clear_nodes()
-
-    p2tButtons = [
-        cmds.button(parent=column, label='1. Make Projections', command=makeProjections),
-        cmds.button(parent=column, label='2. Save Screenshots', command=saveScreenshots),
-        cmds.button(parent=column, label='3. Make Layered Shader', command=makeLayeredShader),
-        cmds.button(parent=column, label='4. Convert Projections To Textures', command=convert),
-        cmds.button(parent=column, label='5. Combine Textures', command=combine),
-        cmds.button(parent=column, label='6. Apply To Shaders', command=applyToShaders),
-        cmds.button(parent=column, label='Reset', command=reset)
-    ]
-    for btn in p2tButtons:
-        cmds.button(btn, edit=True, enable=False)
+        configPath = configPathIn(outdir)
+        controls = readConfigControls()
+        configKey = (configPath, controls)
+        if configKey != lastConfig['key'] or not os.path.exists(configPath):
+            try:
+                config = generateConfig(controls, outdir)
+            except ConfigGenerationError as e:
+                cmds.confirmDialog(title='Error: Invalid configuration', message='Configuration is invalid: {}'.format(e), button='OK')
+                return None
+            lastConfig['key'] = configKey
+            lastConfig['config'] = config
+        return Proj2Tex(targets, **lastConfig['config'])
+
+    def p2tCommand(operation):
+        def command(*args):
+            p2t = makeP2T()
+            if p2t is not None:
+                getattr(p2t, operation)()
+        return command
+
+    p2tButtons = [cmds.button(parent=column, label=label, command=p2tCommand(operation), enable=False) for label, operation in [
+        ('1. Make Projections', 'make_projections'),
+        ('2. Save Screenshots', 'save_screenshots'),
+        ('3. Make Layered Shader', 'make_layered_shader'),
+        ('4. Convert Projections To Textures', 'convert'),
+        ('5. Combine Textures', 'combine'),
+        ('6. Apply To Shaders', 'apply_to_shaders'),
+        ('Reset', 'clear_nodes')
+    ]]
 
     cmds.showWindow(window)
     cmds.window(window, edit=True, width=400, height=650, sizeable=False)